@@ -0,0 +1,223 @@
+"""Benchmarks for the MAVLinkConnection dispatch core.
+
+Measures handler dispatch throughput, receive to handler latency, timer
+jitter and send path contention against a FakeMavfile, and saves the
+results as JSON so runs can be compared across versions::
+
+    python -m benchmarks.bench_dispatch --output new.json --baseline old.json
+"""
+
+import sys
+import time
+import json
+import argparse
+import platform
+import threading
+import contextlib
+
+from mavconn.__version__ import __version__
+from mavconn.mavconn import MAVLinkConnection
+from benchmarks.fakemav import FakeMavfile, DEFAULT_MIX, mavlink
+
+
+def percentiles(samples):
+    """Returns the mean, p50, p90, p99 and max of samples, in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    def rank(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'count': len(ordered), 'mean': sum(ordered) / len(ordered),
+            'p50': rank(0.50), 'p90': rank(0.90), 'p99': rank(0.99),
+            'max': ordered[-1]}
+
+
+@contextlib.contextmanager
+def running(connection):
+    """Starts connection for the duration of the block.
+
+    stop() joins the timer thread, which only wakes up when a timer is due,
+    so a no-op keepalive timer is added to let it exit promptly.
+    """
+    connection.add_timer(0.1, lambda mavconn_instance: None)
+    with connection:
+        yield connection
+
+
+def wait_handled(done, timeout, handled, messages):
+    """Waits for done, raising TimeoutError with the partial count if
+    timeout seconds pass first"""
+    if not done.wait(timeout):
+        raise TimeoutError('handled {} of {} messages within {} s'.format(
+            handled(), messages, timeout))
+
+
+def bench_throughput(messages, workers, mix=None, timeout=60.0):
+    """Dispatches an unpaced stream of messages and reports msgs/s handled"""
+    mavfile = FakeMavfile(mix=mix, count=messages)
+    connection = MAVLinkConnection(mavfile, max_workers=workers)
+    lock = threading.Lock()
+    done = threading.Event()
+    handled = [0]
+    def handler(mavconn_instance, mav_message):
+        with lock:
+            handled[0] += 1
+            if handled[0] == messages:
+                done.set()
+    for name in mix or DEFAULT_MIX:
+        connection.push_handler(name, handler)
+    with running(connection):
+        start = time.perf_counter()
+        wait_handled(done, timeout, lambda: handled[0], messages)
+        elapsed = time.perf_counter() - start
+        queue_wait = connection.queue_wait_stats()
+    return {'messages': messages, 'workers': workers, 'seconds': elapsed,
+            'msgs_per_second': messages / elapsed,
+            'queue_wait': {str(k): v for k, v in queue_wait.items()}}
+
+
+def bench_latency(rate, duration, workers, mix=None, timeout=None):
+    """Dispatches a stream paced at rate msgs/s and reports receive to
+    handler latency percentiles"""
+    if timeout is None:
+        timeout = 5 * duration + 5
+    messages = int(rate * duration)
+    mavfile = FakeMavfile(mix=mix, rate=rate, count=messages)
+    connection = MAVLinkConnection(mavfile, max_workers=workers)
+    lock = threading.Lock()
+    done = threading.Event()
+    latencies = []
+    def handler(mavconn_instance, mav_message):
+        latency = time.perf_counter() - mav_message.created
+        with lock:
+            latencies.append(latency)
+            if len(latencies) == messages:
+                done.set()
+    for name in mix or DEFAULT_MIX:
+        connection.push_handler(name, handler)
+    with running(connection):
+        wait_handled(done, timeout, lambda: len(latencies), messages)
+    return {'rate': rate, 'workers': workers,
+            'latency': percentiles(latencies)}
+
+
+def bench_timer_jitter(period, duration, workers):
+    """Runs a periodic timer and reports how far each interval deviates
+    from period"""
+    connection = MAVLinkConnection(FakeMavfile(count=0), max_workers=workers)
+    calls = []
+    connection.add_timer(period, lambda mavconn_instance:
+                         calls.append(time.perf_counter()))
+    with running(connection):
+        time.sleep(duration)
+    intervals = [b - a for a, b in zip(calls, calls[1:])]
+    return {'period': period,
+            'jitter': percentiles([abs(i - period) for i in intervals])}
+
+
+def bench_send(threads, calls, write_time):
+    """Calls heartbeat_send from several threads at once and reports
+    per-call latency and total sends/s"""
+    mavfile = FakeMavfile(count=0, write_time=write_time)
+    connection = MAVLinkConnection(mavfile)
+    barrier = threading.Barrier(threads)
+    lock = threading.Lock()
+    latencies = []
+    def work():
+        local = []
+        barrier.wait()
+        for _ in range(calls):
+            start = time.perf_counter()
+            connection.heartbeat_send(mavlink.MAV_TYPE_GCS,
+                                      mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {'threads': threads, 'calls': threads * calls,
+            'write_time': write_time,
+            'sends_per_second': threads * calls / elapsed,
+            'latency': percentiles(latencies)}
+
+
+def run(args):
+    """Runs every benchmark and returns the results as a dict"""
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {
+            'throughput': bench_throughput(args.messages, args.workers),
+            'latency': bench_latency(args.rate, args.duration, args.workers),
+            'timer_jitter': bench_timer_jitter(args.period, args.duration,
+                                               args.workers),
+            'send': bench_send(args.threads, args.calls, args.write_time),
+        },
+    }
+
+
+def flatten(results, prefix=''):
+    """Flattens nested results into {'a.b.c': number}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Returns lines showing each metric of current against baseline"""
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    lines = ['{} -> {}'.format(baseline['version'], current['version'])]
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key] / old[key] if old[key] else float('nan')
+        lines.append('{:<40} {:>14.6g} {:>14.6g} {:>8.2f}x'.format(
+            key, old[key], new[key], ratio))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='messages dispatched by the throughput benchmark')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='msgs/s generated by the latency benchmark')
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='seconds the latency and timer benchmarks run')
+    parser.add_argument('--period', type=float, default=0.05,
+                        help='timer period in seconds')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='handler worker threads (executor default if unset)')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='threads sharing the send path')
+    parser.add_argument('--calls', type=int, default=2000,
+                        help='send calls made by each thread')
+    parser.add_argument('--write-time', type=float, default=0.0,
+                        help='seconds each simulated port write blocks')
+    parser.add_argument('--output', help='file to save the JSON results to')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    args = parser.parse_args(argv)
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.baseline:
+        with open(args.baseline) as f:
+            print('\n'.join(compare(json.load(f), results)))
+    return results
+
+
+if __name__ == '__main__':
+    main()
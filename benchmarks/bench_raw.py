@@ -0,0 +1,174 @@
+"""Allocation benchmark for raw frame handlers.
+
+Streams pymavlink-encoded packets from a FakeMavfile and uses tracemalloc
+to measure the memory allocated while they are handled as messages decoded
+by pymavlink, as zero-copy raw frames, and as raw frames copied with
+bytes(). Each mode is run twice: threaded at a fixed rate to measure peak
+memory, and on the calling thread to count the blocks each packet
+allocates::
+
+    python -m benchmarks.bench_raw --rate 5000 --output raw.json
+"""
+
+import sys
+import time
+import json
+import argparse
+import platform
+import threading
+import tracemalloc
+from concurrent.futures import Executor, Future
+
+from mavconn.__version__ import __version__
+from mavconn.mavconn import MAVLinkConnection, Dispatcher
+from benchmarks.fakemav import FakeMavfile, DEFAULT_MIX
+from benchmarks.bench_dispatch import running, wait_handled
+
+MODES = ('decoded', 'raw', 'raw_copy')
+
+
+class InlineExecutor(Executor):
+    """Executor that runs each job on the submitting thread"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+
+def connect(mode, mavfile, on_packet, **kwargs):
+    """Returns a MAVLinkConnection that calls on_packet() from a handler
+    for every packet, in the given mode"""
+    connection = MAVLinkConnection(mavfile, **kwargs)
+    kept = []
+    def decoded_handler(mavconn_instance, mav_message):
+        on_packet()
+    def raw_handler(mavconn_instance, header, frame):
+        on_packet()
+    def copy_handler(mavconn_instance, header, frame):
+        kept[:] = [bytes(frame)]
+        on_packet()
+    if mode == 'decoded':
+        for name in DEFAULT_MIX:
+            connection.push_handler(name, decoded_handler)
+    else:
+        connection.push_raw_handler(
+            '*', raw_handler if mode == 'raw' else copy_handler)
+    return connection
+
+
+def bench_allocations(mode, rate, duration, warmup=0.1, timeout=None):
+    """Handles rate * duration packets in mode on the connection's threads
+    and reports the time taken and the memory traced after the first warmup
+    fraction of them"""
+    if timeout is None:
+        timeout = 5 * duration + 5
+    messages = int(rate * duration)
+    lock = threading.Lock()
+    warm = threading.Event()
+    done = threading.Event()
+    handled = [0]
+    def on_packet():
+        with lock:
+            handled[0] += 1
+            if handled[0] == int(messages * warmup):
+                warm.set()
+            if handled[0] == messages:
+                done.set()
+    connection = connect(mode, FakeMavfile(rate=rate, count=messages),
+                         on_packet, max_workers=1)
+    tracemalloc.start()
+    try:
+        with running(connection):
+            wait_handled(warm, timeout, lambda: handled[0], messages)
+            tracemalloc.clear_traces()
+            start = time.perf_counter()
+            wait_handled(done, timeout, lambda: handled[0], messages)
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    packets = messages - int(messages * warmup)
+    return {'mode': mode, 'rate': rate, 'packets': packets, 'seconds': elapsed,
+            'packets_per_second': packets / elapsed,
+            'current_bytes': current, 'peak_bytes': peak}
+
+
+def sample_allocations(mode, packets, warmup=0.1):
+    """Handles packets on the calling thread and reports what each one
+    allocates, averaged over all but the first warmup fraction of them
+
+    Traces are cleared after every packet, and a snapshot is taken from
+    the packet's handler, so blocks_per_packet and bytes_per_packet count
+    what was allocated for that packet and is still alive when its handler
+    runs: the decoded message and its fields, or the frame view. Anything
+    allocated and freed before the handler shows up in
+    peak_bytes_per_packet.
+    """
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    samples = []
+    def on_packet():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        stats = snapshot.statistics('filename')
+        samples.append((sum(stat.count for stat in stats),
+                        sum(stat.size for stat in stats), peak))
+        tracemalloc.clear_traces()
+    mavfile = FakeMavfile(count=packets)
+    connection = connect(mode, mavfile, on_packet, executor=InlineExecutor())
+    connection._dispatcher = Dispatcher(connection._threadpool)
+    tracemalloc.start()
+    try:
+        while len(samples) < packets:
+            if mode == 'decoded':
+                with connection._stacks_lock:
+                    connection._dispatch(mavfile.recv_match())
+            else:
+                connection._receive_frames()
+    finally:
+        tracemalloc.stop()
+    samples = samples[int(packets * warmup):]
+    return {'sampled_packets': len(samples),
+            'blocks_per_packet': sum(s[0] for s in samples) / len(samples),
+            'bytes_per_packet': sum(s[1] for s in samples) / len(samples),
+            'peak_bytes_per_packet': sum(s[2] for s in samples) / len(samples)}
+
+
+def run(args):
+    """Runs the allocation benchmark in every mode and returns the results"""
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {mode: dict(bench_allocations(mode, args.rate,
+                                                 args.duration),
+                               **sample_allocations(mode, args.samples))
+                    for mode in MODES},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=5000.0,
+                        help='packets/s generated')
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='seconds each mode runs')
+    parser.add_argument('--samples', type=int, default=2000,
+                        help='packets sampled per mode on the calling thread')
+    parser.add_argument('--output', help='file to save the JSON results to')
+    args = parser.parse_args(argv)
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return results
+
+
+if __name__ == '__main__':
+    main()
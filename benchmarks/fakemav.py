@@ -0,0 +1,175 @@
+"""Synthetic mavfile that generates MAVLink messages at a configurable
+     mix and rate, for benchmarking the dispatch core"""
+
+import time
+import random
+import bisect
+import itertools
+import threading
+
+from pymavlink.dialects.v20 import common as mavlink
+
+
+DEFAULT_MIX = {'HEARTBEAT': 1, 'ATTITUDE': 50, 'GLOBAL_POSITION_INT': 10,
+               'SYS_STATUS': 2, 'COMMAND_ACK': 1}
+
+# Bytes returned by FakeMavfile.recv() when no size is given
+DEFAULT_READ_SIZE = 4096
+
+
+def encode_frame(name, seq=0, sysid=1, compid=1):
+    """Returns a MAVLink 2 frame for name, encoded by the pymavlink common
+    dialect with every field set to 1"""
+    message_class = mavlink.mavlink_map[getattr(mavlink,
+                                                'MAVLINK_MSG_ID_' + name)]
+    message = message_class(**{field: 1 for field in message_class.fieldnames})
+    mav = mavlink.MAVLink(None, srcSystem=sysid, srcComponent=compid)
+    mav.seq = seq
+    return bytes(message.pack(mav))
+
+
+class FakeMavfile:
+    """Generates a reproducible stream of pymavlink messages from recv_match,
+    or of the equivalent raw MAVLink 2 frames from recv.
+
+    Note
+    ----
+    recv_match() decodes each frame with mav.parse_char(), as a real
+    mavfile does, and tags the message with a created attribute holding
+    the time.perf_counter() value the frame was generated at.
+
+    Attributes
+    ----------
+        _names : (list of str)
+            Message names to draw from
+        _frames : (dict of str: bytes)
+            Raw frame generated for each name in _names
+        _cumulative : (list of float)
+            Running sum of the relative frequency of each name in _names
+        _rate : (float)
+            Messages per second to generate, or None to generate as fast as
+            they are read
+        _count : (int)
+            Number of messages to generate before the stream ends, or None
+            for an endless stream
+        _random : ()
+            Seeded random generator so message mixes are reproducible
+        _seq : (int)
+            Number of messages generated so far
+        _start : (float)
+            time.perf_counter() value the first message was due at
+        _pending : (bytearray)
+            Generated bytes not yet returned by recv
+        _write_time : (float)
+            Seconds each write blocks for, simulating a port write
+        _write_lock : ()
+            Threading lock for sent
+        sent : (int)
+            Number of packets written by the send path
+        mav : ()
+            pymavlink MAVLink object that decodes received frames and
+            encodes sent messages
+        first_byte : (bool)
+            Always False, as the protocol version never needs auto-switching
+        logfile : ()
+            Telemetry log, None unless set by the caller
+        logfile_raw : ()
+            Raw log, None unless set by the caller
+    """
+
+    def __init__(self, mix=None, rate=None, count=None, seed=0, write_time=0.0):
+        mix = mix or DEFAULT_MIX
+        self._names = sorted(mix)
+        self._cumulative = list(itertools.accumulate(
+            mix[name] for name in self._names))
+        self._frames = {name: encode_frame(name) for name in self._names}
+        self._rate = rate
+        self._count = count
+        self._random = random.Random(seed)
+        self._seq = 0
+        self._start = None
+        self._pending = bytearray()
+        self._write_time = write_time
+        self._write_lock = threading.Lock()
+        self.sent = 0
+        self.mav = mavlink.MAVLink(self, srcSystem=255, srcComponent=0)
+        self.first_byte = False
+        self.logfile = None
+        self.logfile_raw = None
+
+    def recv_match(self, blocking=False, timeout=None, **kwargs):
+        """Returns the next decoded message, pacing the stream to _rate if set"""
+        if self._remaining() == 0:
+            if blocking:
+                time.sleep(0.01)
+            return None
+        if self._rate:
+            delay = self._due(self._seq) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        created = time.perf_counter()
+        message = self.mav.parse_char(self._frames[self._next_name()])
+        self._seq += 1
+        message.created = created
+        return message
+
+    def recv(self, n=None):
+        """Returns at most n bytes of the frames due, without blocking.
+        Bytes that do not fit are returned by the next call."""
+        n = n or DEFAULT_READ_SIZE
+        due = self._remaining()
+        if self._rate:
+            now = time.perf_counter()
+            paced = int((now - self._due(0)) * self._rate) + 1 - self._seq
+            due = paced if due is None else min(due, paced)
+        while len(self._pending) < n and (due is None or due > 0):
+            self._pending += self._frames[self._next_name()]
+            self._seq += 1
+            if due is not None:
+                due -= 1
+        data = bytes(self._pending[:n])
+        del self._pending[:n]
+        return data
+
+    def select(self, timeout):
+        """Waits up to timeout seconds for the next message to be due"""
+        if self._pending:
+            return True
+        if self._remaining() == 0:
+            time.sleep(timeout)
+        elif self._rate:
+            delay = self._due(self._seq) - time.perf_counter()
+            time.sleep(min(timeout, max(delay, 0)))
+        return True
+
+    def write(self, buf):
+        """Counts a packet written by the send path"""
+        if self._write_time:
+            time.sleep(self._write_time)
+        with self._write_lock:
+            self.sent += 1
+
+    def pre_message(self):
+        pass
+
+    def auto_mavlink_version(self, buf):
+        pass
+
+    def post_message(self, msg):
+        pass
+
+    def _remaining(self):
+        """Returns the number of messages left to generate, or None if endless"""
+        if self._count is None:
+            return None
+        return self._count - self._seq
+
+    def _due(self, seq):
+        """Returns the time.perf_counter() value message seq is due at"""
+        if self._start is None:
+            self._start = time.perf_counter()
+        return self._start + seq / self._rate
+
+    def _next_name(self):
+        pick = self._random.random() * self._cumulative[-1]
+        return self._names[bisect.bisect(self._cumulative, pick)]
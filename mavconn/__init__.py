@@ -1,4 +1,6 @@
 from .core import *
 from .mavconn import MAVLinkConnection
+from .mavconn import PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BULK
 
-__all__ = ['MAVLinkConnection']
+__all__ = ['MAVLinkConnection', 'PRIORITY_CRITICAL', 'PRIORITY_NORMAL',
+           'PRIORITY_BULK']
@@ -0,0 +1,251 @@
+"""Splits a raw MAVLink byte stream into frames without decoding them"""
+
+MAVLINK1_STX = 0xFE
+MAVLINK2_STX = 0xFD
+MAVLINK1_HEADER_LENGTH = 6
+MAVLINK2_HEADER_LENGTH = 10
+CHECKSUM_LENGTH = 2
+SIGNATURE_LENGTH = 13
+IFLAG_SIGNED = 0x01
+MAX_FRAME_LENGTH = (MAVLINK2_HEADER_LENGTH + 255 + CHECKSUM_LENGTH
+                    + SIGNATURE_LENGTH)
+
+
+def _crc_table():
+    """Returns the lookup table for the X.25 (CRC-16/MCRF4XX) checksum"""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC_TABLE = _crc_table()
+
+
+def x25crc(buffer, start, end, crc_extra):
+    """Returns the MAVLink checksum of buffer[start:end] followed by crc_extra"""
+    table = CRC_TABLE
+    crc = 0xFFFF
+    for index in range(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ buffer[index]) & 0xFF]
+    return (crc >> 8) ^ table[(crc ^ crc_extra) & 0xFF]
+
+
+class FrameHeader:
+    """Header fields of the frame currently being handled.
+
+    Note
+    ----
+    A FrameParser reuses one FrameHeader for every frame it yields, so the
+    fields are only valid until the next frame is parsed.
+
+    Attributes
+    ----------
+        version : (int)
+            MAVLink protocol version of the frame, 1 or 2
+        length : (int)
+            Payload length in bytes
+        incompat_flags : (int)
+            MAVLink 2 incompatibility flags, 0 for MAVLink 1
+        compat_flags : (int)
+            MAVLink 2 compatibility flags, 0 for MAVLink 1
+        seq : (int)
+            Packet sequence number
+        sysid : (int)
+            ID of the sending system
+        compid : (int)
+            ID of the sending component
+        msgid : (int)
+            MAVLink message ID. For example, 0 for HEARTBEAT
+        header_length : (int)
+            Offset of the payload in the frame
+        signed : (bool)
+            True if the frame ends with a MAVLink 2 signature
+        crc_ok : (bool)
+            True if the checksum was verified, or None if it could not be
+            because the message ID has no CRC_EXTRA entry or the parser has
+            no CRC_EXTRA table. Frames failing verification are never
+            yielded.
+    """
+
+    __slots__ = ('version', 'length', 'incompat_flags', 'compat_flags', 'seq',
+                 'sysid', 'compid', 'msgid', 'header_length', 'signed',
+                 'crc_ok')
+
+    def __init__(self):
+        self.version = 0
+        self.length = 0
+        self.incompat_flags = 0
+        self.compat_flags = 0
+        self.seq = 0
+        self.sysid = 0
+        self.compid = 0
+        self.msgid = 0
+        self.header_length = 0
+        self.signed = False
+        self.crc_ok = None
+
+
+class FrameParser:
+    """Delimits MAVLink 1 and 2 frames in a reused receive buffer.
+
+    Note
+    ----
+    Frames are yielded as memoryview slices of the receive buffer, which is
+    overwritten by later calls to feed(). Use bytes(frame) to keep a frame
+    beyond the current iteration. When crc_extras is set, frames with a
+    known message ID and a bad checksum or unsupported incompatibility
+    flags are dropped and the parser resynchronizes on the next byte.
+    Frames with a message ID missing from crc_extras are yielded
+    unverified, so forwarders can pass on messages from other dialects.
+
+    Attributes
+    ----------
+        crc_extras : (dict of int: int)
+            CRC_EXTRA byte of each message ID in the dialect, or None to
+            skip checksum verification
+        _buffer : (bytearray)
+            Fixed size receive buffer, never resized so memoryviews into it
+            stay valid
+        _view : (memoryview)
+            View of _buffer that frames are sliced from
+        _start : (int)
+            Offset of the first unparsed byte in _buffer
+        _end : (int)
+            Offset one past the last received byte in _buffer
+        _header : (FrameHeader)
+            Header fields of the frame most recently yielded
+    """
+
+    def __init__(self, crc_extras=None, size=65536):
+        if size < MAX_FRAME_LENGTH:
+            raise ValueError('Buffer size must be at least {} bytes'.format(
+                MAX_FRAME_LENGTH))
+        self.crc_extras = crc_extras
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._header = FrameHeader()
+
+    def feed(self, data):
+        """Appends data to the receive buffer and yields the complete frames
+
+        Parameters
+        ----------
+        data : (bytes)
+            Bytes read from the MAVLink port
+
+        Yields
+        ------
+        header : (FrameHeader)
+            Parsed header fields of the frame
+        frame : (memoryview)
+            The whole frame, from start byte to checksum or signature
+        """
+        data = memoryview(data)
+        while data:
+            if self._start == self._end:
+                self._start = self._end = 0
+            elif self._end == len(self._buffer):
+                self._compact()
+            count = min(len(data), len(self._buffer) - self._end)
+            self._buffer[self._end:self._end + count] = data[:count]
+            self._end += count
+            data = data[count:]
+            for frame in self._frames():
+                yield frame
+
+    def _compact(self):
+        """Moves unparsed bytes to the front of the receive buffer"""
+        pending = self._end - self._start
+        self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def _frames(self):
+        """Yields the complete frames between _start and _end"""
+        buffer = self._buffer
+        header = self._header
+        while True:
+            start = self._start
+            end = self._end
+            if start < end and buffer[start] not in (MAVLINK1_STX, MAVLINK2_STX):
+                start = self._find_stx(start, end)
+                self._start = start
+            available = end - start
+            if available < 3:
+                return
+            length = buffer[start + 1]
+            if buffer[start] == MAVLINK1_STX:
+                header_length = MAVLINK1_HEADER_LENGTH
+                incompat_flags = 0
+                signature_length = 0
+            else:
+                header_length = MAVLINK2_HEADER_LENGTH
+                incompat_flags = buffer[start + 2]
+                signature_length = (SIGNATURE_LENGTH
+                                    if incompat_flags & IFLAG_SIGNED else 0)
+            total = header_length + length + CHECKSUM_LENGTH + signature_length
+            if available < total:
+                return
+            if header_length == MAVLINK1_HEADER_LENGTH:
+                msgid = buffer[start + 5]
+            else:
+                msgid = (buffer[start + 7] | buffer[start + 8] << 8
+                         | buffer[start + 9] << 16)
+            crc_ok = self._check(start, header_length + length, msgid,
+                                 incompat_flags)
+            if crc_ok is False:
+                self._start = start + 1
+                continue
+            header.crc_ok = crc_ok
+            header.length = length
+            header.header_length = header_length
+            header.incompat_flags = incompat_flags
+            header.signed = bool(signature_length)
+            header.msgid = msgid
+            if header_length == MAVLINK1_HEADER_LENGTH:
+                header.version = 1
+                header.compat_flags = 0
+                header.seq = buffer[start + 2]
+                header.sysid = buffer[start + 3]
+                header.compid = buffer[start + 4]
+            else:
+                header.version = 2
+                header.compat_flags = buffer[start + 3]
+                header.seq = buffer[start + 4]
+                header.sysid = buffer[start + 5]
+                header.compid = buffer[start + 6]
+            self._start = start + total
+            yield header, self._view[start:start + total]
+
+    def drain(self):
+        """Discards and returns the unparsed bytes in the receive buffer"""
+        pending = bytes(self._buffer[self._start:self._end])
+        self._start = self._end = 0
+        return pending
+
+    def _check(self, start, checked_length, msgid, incompat_flags):
+        """Returns True if the frame at start has a matching checksum and no
+        unsupported incompatibility flags, False if not, or None if the
+        message ID has no CRC_EXTRA entry to check against"""
+        if self.crc_extras is None:
+            return None
+        crc_extra = self.crc_extras.get(msgid)
+        if crc_extra is None:
+            return None
+        if incompat_flags & ~IFLAG_SIGNED:
+            return False
+        end = start + checked_length
+        checksum = self._buffer[end] | self._buffer[end + 1] << 8
+        return checksum == x25crc(self._buffer, start + 1, end, crc_extra)
+
+    def _find_stx(self, start, end):
+        """Returns the offset of the next start byte, or end if there is none"""
+        found = [index for index in (self._buffer.find(MAVLINK1_STX, start, end),
+                                     self._buffer.find(MAVLINK2_STX, start, end))
+                 if index >= 0]
+        return min(found) if found else end
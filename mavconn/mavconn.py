@@ -1,13 +1,28 @@
 """Library provides a threadsafe, callback-based interface
      to the Python MAVLink library"""
 
+import sys
 import time
+import struct
+import logging
 import threading
 import datetime
+import itertools
 from datetime import timedelta
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
-from heapq import heappush, heappop
+from concurrent.futures import ThreadPoolExecutor, Future
+from heapq import heappush, heappop, heapify
+
+from .frame import FrameParser, MAVLINK1_HEADER_LENGTH, CHECKSUM_LENGTH
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# Bytes requested from the mavfile per read while raw frame handlers are pushed
+RAW_READ_SIZE = 4096
+
+logger = logging.getLogger(__name__)
 
 
 class MAVLinkConnection:
@@ -26,12 +41,29 @@ class MAVLinkConnection:
         _threadpool : ()
             Pool of worker threads that execute handlers passed from timer/listening
             threads
+        _max_workers : (int)
+            Number of worker threads used when the threadpool is created by start()
+        _owns_threadpool : (bool)
+            True if the threadpool was created by start() and should be shut down
+            by stop(), False if it was supplied by the caller
+        _dispatcher : ()
+            Orders handler jobs by priority class before they reach the threadpool
         _stacks_lock: ()
             Threading lock for _stacks
         _stacks : (dict of str: func)
             Contains stacks for various MAVLink message types and the associated
             handlers for those message types. For example,
             {'Heartbeat',[handler1, handler2, handler3']}
+        _priorities : (dict of str: list)
+            Priority classes of the handlers in _stacks, kept in the same order.
+        _raw_stacks : (dict of int: func)
+            Contains stacks of raw frame handlers keyed by MAVLink message ID,
+            or '*' for any message ID
+        _parser : (FrameParser)
+            Splits bytes read from the mavfile into raw frames
+        _crc_mav : ()
+            The mavfile.mav whose dialect _parser's CRC_EXTRA table was
+            taken from
         _futures : (list)
             Contains futures from jobs submitted to threadpool to keep track of
             unfinished jobs
@@ -47,14 +79,23 @@ class MAVLinkConnection:
             Lock for _continue to ensure the boolean value can be toggled.
     """
 
-    def __init__(self, mavfile):
+    def __init__(self, mavfile, max_workers=None, executor=None):
+        if max_workers is not None and executor is not None:
+            raise ValueError('Give either max_workers or executor, not both')
         self._mavfile = mavfile
         self._mav_lock = threading.Lock()
         self._timer_thread = None
         self._listening_thread = None
-        self._threadpool = None
+        self._threadpool = executor
+        self._max_workers = max_workers
+        self._owns_threadpool = executor is None
+        self._dispatcher = None
         self._stacks_lock = threading.Lock()
         self._stacks = defaultdict(list)
+        self._priorities = defaultdict(list)
+        self._raw_stacks = defaultdict(list)
+        self._parser = FrameParser()
+        self._crc_mav = None
         self._futures = []
         self._timers = []
         self._timers_cv = threading.Condition()
@@ -63,7 +104,9 @@ class MAVLinkConnection:
 
     def start(self):
         """ Initializes the timer, listening, and handler worker threads."""
-        self._threadpool = ThreadPoolExecutor()
+        if self._owns_threadpool:
+            self._threadpool = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._dispatcher = Dispatcher(self._threadpool)
         self._listening_thread = threading.Thread(target=self.listening_work)
         self._timer_thread = threading.Thread(target=self.timer_work)
         self._listening_thread.start()
@@ -75,7 +118,8 @@ class MAVLinkConnection:
             self._continue = False
         self._timer_thread.join()
         self._listening_thread.join()
-        self._threadpool.shutdown()
+        if self._owns_threadpool:
+            self._threadpool.shutdown()
 
     def __enter__(self):
         self.start()
@@ -84,7 +128,7 @@ class MAVLinkConnection:
     def __exit__(self, exc_type, exc_value, traceback):
         self.stop()
 
-    def push_handler(self, message_name, handler):
+    def push_handler(self, message_name, handler, priority=PRIORITY_NORMAL):
         """Pushes MAVLink message and associated handler unto appropriate stack
 
         Parameters
@@ -94,9 +138,13 @@ class MAVLinkConnection:
         handler : (func)
             The function that is to be performed
             (associated with a type of MAVLink message)
+        priority : (int)
+            Priority class of the handler. Lower values are dequeued first,
+            for example PRIORITY_CRITICAL ahead of PRIORITY_BULK.
         """
         with self._stacks_lock:
             self._stacks[message_name].append(handler)
+            self._priorities[message_name].append(priority)
 
     def pop_handler(self, message_name):
         """Pops the last handler in a stack with a given MAVLink message type
@@ -115,6 +163,7 @@ class MAVLinkConnection:
         with self._stacks_lock:
             try:
                 handler = self._stacks[message_name].pop()
+                self._priorities[message_name].pop()
                 return handler
             except (KeyError, IndexError):
                 raise KeyError('That message name key does not exist!')
@@ -130,10 +179,68 @@ class MAVLinkConnection:
         with self._stacks_lock:
             if message_name:
                 self._stacks.pop(message_name)
+                self._priorities.pop(message_name, None)
             else:
                 self._stacks.clear()
+                self._priorities.clear()
+
+    def push_raw_handler(self, msgid, handler):
+        """Pushes a raw frame handler unto the stack for a MAVLink message ID
+
+        While any raw frame handler is pushed, the listening thread reads
+        bytes from the mavfile itself and calls the handler on the listening
+        thread as handler(mavconn_instance, header, frame), where header is a
+        FrameHeader and frame is a memoryview of the whole packet. Both are
+        reused for the next packet, so handlers must be quick and must copy
+        the frame with bytes(frame) to keep it.
+
+        Parameters
+        ----------
+        msgid : (int)
+            The MAVLink message ID. For example, 0 for HEARTBEAT, or '*'
+            for any message ID
+        handler : (func)
+            The function that is to be performed
+            (associated with a MAVLink message ID)
+        """
+        with self._stacks_lock:
+            self._raw_stacks[msgid].append(handler)
+
+    def pop_raw_handler(self, msgid):
+        """Pops the last raw frame handler in a stack with a given MAVLink message ID
+
+        Parameters
+        ----------
+        msgid : (int)
+            The MAVLink message ID, or '*'
 
-    def add_timer(self, period, handler):
+        Returns
+        -------
+        handler : (func)
+            The raw frame handler that was popped
+        """
+        with self._stacks_lock:
+            try:
+                return self._raw_stacks[msgid].pop()
+            except (KeyError, IndexError):
+                raise KeyError('That message ID key does not exist!')
+
+    def clear_raw_handler(self, msgid=None):
+        """Removes all raw frame handlers in the stack assoc. with a MAVLink message ID
+
+        Parameters
+        ----------
+        msgid : (int)
+            The MAVLink message ID, or '*'. All raw frame handlers are
+            removed if not given.
+        """
+        with self._stacks_lock:
+            if msgid is not None:
+                self._raw_stacks.pop(msgid)
+            else:
+                self._raw_stacks.clear()
+
+    def add_timer(self, period, handler, priority=PRIORITY_NORMAL):
         """Adds a timer object to heap queue with assoc. repeating period and handler
 
         Parameters
@@ -143,9 +250,11 @@ class MAVLinkConnection:
         handler : (func)
             The function that is to be performed at intervals indicated by
             the timer period)
+        priority : (int)
+            Priority class of the handler. Lower values are dequeued first.
         """
         with self._timers_cv:
-            heappush(self._timers, Timer(period, handler))
+            heappush(self._timers, Timer(period, handler, priority))
             self._timers_cv.notify()
 
     def timer_work(self):
@@ -174,23 +283,161 @@ class MAVLinkConnection:
                 thread should keep running"""
             with self._continue_lock:
                 return self._continue
+        raw_mode = False
         while get_cont_val():
+            with self._stacks_lock:
+                raw = any(self._raw_stacks.values())
+            if raw != raw_mode:
+                self._switch_mode(raw)
+                raw_mode = raw
+            if raw:
+                self._receive_frames()
+                continue
             with self._stacks_lock:
                 mav_message = self._mavfile.recv_match(
                     blocking=True, timeout=timedelta(milliseconds=100))
+                self._dispatch(mav_message)
+
+    def _switch_mode(self, raw):
+        """Hands bytes buffered by one receive path over to the other.
+
+        Entering raw mode, the unparsed bytes in mavfile.mav's stream buffer
+        are moved to _parser. Leaving it, the partial frame in _parser is
+        passed to mavfile.mav.parse_char().
+        """
+        mav = self._mavfile.mav
+        try:
+            if raw:
+                pending = bytes(mav.buf[mav.buf_index:])
+                mav.buf = bytearray()
+                mav.buf_index = 0
+                mav.expected_length = MAVLINK1_HEADER_LENGTH + CHECKSUM_LENGTH
+                self._handle_frames(pending)
+            else:
+                pending = self._parser.drain()
+                mav_message = mav.parse_char(pending) if pending else None
+                if mav_message is not None:
+                    self._mavfile.post_message(mav_message)
+                    with self._stacks_lock:
+                        self._dispatch(mav_message)
+        except Exception:
+            logger.exception('Failed to hand over buffered bytes when '
+                             'switching receive mode')
+
+    def _receive_frames(self):
+        """Reads bytes from the mavfile and calls raw frame handlers in place.
+
+        The mavfile's recv_msg() is bypassed, so its pre_message(),
+        protocol version auto-switch and logfile_raw writes are done here
+        instead.
+        """
+        mavfile = self._mavfile
+        mavfile.pre_message()
+        data = mavfile.recv(RAW_READ_SIZE)
+        if not data:
+            mavfile.select(0.1)
+            return
+        if mavfile.logfile_raw:
+            mavfile.logfile_raw.write(data)
+        if mavfile.first_byte:
+            mavfile.auto_mavlink_version(data)
+        self._handle_frames(data)
+
+    def _update_crc_extras(self):
+        """Loads _parser's CRC_EXTRA table from the dialect of mavfile.mav.
+
+        Falls back to unverified frames if the dialect module has no usable
+        mavlink_map, for example with older pymavlink versions.
+        """
+        mav = self._mavfile.mav
+        if mav is self._crc_mav:
+            return
+        self._crc_mav = mav
+        try:
+            dialect = sys.modules[type(mav).__module__]
+            self._parser.crc_extras = {
+                msgid: message.crc_extra
+                for msgid, message in dialect.mavlink_map.items()}
+        except Exception:
+            logger.warning('No CRC_EXTRA table found for %s, raw frames '
+                           'will not be checksum verified', type(mav).__name__)
+            self._parser.crc_extras = None
+
+    def _handle_frames(self, data):
+        """Parses data into frames and calls raw frame handlers in place.
+
+        Raw handlers run on the listening thread because the frame they are
+        given is only valid until the next frame is parsed. Exceptions they
+        raise are logged so the listening thread keeps running. Frames are
+        also written to mavfile.logfile, and decoded and dispatched to
+        message handlers if any are pushed.
+        """
+        mavfile = self._mavfile
+        self._update_crc_extras()
+        verified = self._parser.crc_extras is not None
+        for header, frame in self._parser.feed(data):
+            with self._stacks_lock:
+                stack = (self._raw_stacks.get(header.msgid)
+                         or self._raw_stacks.get('*'))
+                handler = stack[-1] if stack else None
+                decode = any(self._stacks.values())
+            if mavfile.logfile:
+                usec = int(time.time() * 1.0e6) & ~3
+                mavfile.logfile.write(struct.pack('>Q', usec))
+                mavfile.logfile.write(frame)
+            if handler:
+                try:
+                    handler(self, header, frame)
+                except Exception:
+                    logger.exception('Raw frame handler for message ID %d '
+                                     'failed', header.msgid)
+            if decode and (header.crc_ok or not verified):
                 try:
-                    handler = self._stacks[mav_message.name][-1]
-                    self._futures = [x for x in self._futures if not x.done()]
-                    self._futures.append(self._threadpool.submit(
-                        handler, self, mav_message))
-                except:
-                    try:
-                        handler = self._stacks['*'][-1]
-                        self._futures = [x for x in self._futures if not x.done()]
-                        self._futures.append(self._threadpool.submit(
-                            handler, self, mav_message))
-                    except (KeyError, IndexError):
-                        pass
+                    mav_message = mavfile.mav.decode(bytearray(frame))
+                except Exception:
+                    logger.exception('Failed to decode message ID %d',
+                                     header.msgid)
+                    continue
+                mavfile.post_message(mav_message)
+                with self._stacks_lock:
+                    self._dispatch(mav_message)
+
+    def _dispatch(self, mav_message):
+        """Submits the handler for mav_message to the threadpool.
+
+        Must be called with _stacks_lock held.
+        """
+        try:
+            name = (mav_message.get_type() if hasattr(mav_message, 'get_type')
+                    else mav_message.name)
+            handler = self._stacks[name][-1]
+            priority = self._priorities[name][-1]
+            self._futures = [x for x in self._futures if not x.done()]
+            self._futures.append(self._dispatcher.submit(
+                priority, handler, self, mav_message))
+        except:
+            try:
+                handler = self._stacks['*'][-1]
+                priority = self._priorities['*'][-1]
+                self._futures = [x for x in self._futures if not x.done()]
+                self._futures.append(self._dispatcher.submit(
+                    priority, handler, self, mav_message))
+            except (KeyError, IndexError):
+                pass
+
+    def queue_wait_stats(self):
+        """Returns queue wait time metrics for each priority class
+
+        Returns
+        -------
+        stats : (dict of int: dict)
+            Maps each priority class to a dict with the number of jobs
+            dequeued ('count') and the 'mean' and 'max' time in seconds
+            they waited for a worker thread.
+        """
+        if self._dispatcher is None:
+            return {}
+        return self._dispatcher.stats()
 
     def __getattr__(self, name):
         '''Wrapper provides exclusionary access to mavfile; threadsafe'''
@@ -200,6 +447,112 @@ class MAVLinkConnection:
         return wrapper
 
 
+class Dispatcher:
+    """Orders jobs submitted to an executor by priority class.
+
+    Note
+    ----
+    Every submit() hands the executor one job slot, but the worker that
+    takes the slot runs the most urgent job pending at that moment. Jobs
+    of the same priority class run in submission order. Each job gets its
+    own future, so results and exceptions belong to the job that
+    produced them.
+
+    Attributes
+    ----------
+        _executor : ()
+            The executor whose worker threads run the jobs
+        _lock : ()
+            Reentrant threading lock for _jobs and _stats, held while a slot
+            is submitted so a failed submit can withdraw its own job
+        _jobs : (list)
+            A heap queue of (priority, sequence, enqueue time, future, func,
+            args)
+        _sequence : ()
+            Counter that keeps jobs of equal priority in FIFO order
+        _stats : (dict of int: QueueStats)
+            Queue wait time metrics for each priority class
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._lock = threading.RLock()
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._stats = defaultdict(QueueStats)
+
+    def submit(self, priority, func, *args):
+        """Queues func(*args) under the given priority class
+
+        Returns
+        -------
+        future : (Future)
+            Future that is completed with the result or exception of func
+        """
+        future = Future()
+        job = (priority, next(self._sequence), time.monotonic(), future,
+               func, args)
+        with self._lock:
+            heappush(self._jobs, job)
+            try:
+                self._executor.submit(self._run_next)
+            except:
+                self._jobs.remove(job)
+                heapify(self._jobs)
+                raise
+        return future
+
+    def _run_next(self):
+        """Runs the most urgent pending job on the calling worker thread"""
+        with self._lock:
+            priority, _, enqueue_time, future, func, args = heappop(self._jobs)
+            self._stats[priority].record(time.monotonic() - enqueue_time)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        """Returns a snapshot of the queue wait time metrics per priority class"""
+        with self._lock:
+            return {priority: stats.summary()
+                    for priority, stats in self._stats.items()}
+
+
+class QueueStats:
+    """Accumulates the time jobs of one priority class spend waiting in queue.
+
+    Attributes
+    ----------
+        _count : (int)
+            Number of jobs dequeued
+        _total : (float)
+            Sum of the wait times in seconds
+        _max : (float)
+            Longest wait time in seconds
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, wait):
+        """Adds the wait time in seconds of one dequeued job"""
+        self._count += 1
+        self._total += wait
+        self._max = max(self._max, wait)
+
+    def summary(self):
+        """Returns a dict with the 'count', 'mean' and 'max' wait times"""
+        mean = self._total / self._count if self._count else 0.0
+        return {'count': self._count, 'mean': mean, 'max': self._max}
+
+
 class Timer:
     """Creates objects with a time period interval, handler, and next calendar
     time for handler call.
@@ -217,14 +570,17 @@ class Timer:
         _handler : (func)
             The function that is to be performed at intervals indicated by
             the timer period
+        _priority : (int)
+            Priority class the handler is dispatched with
         _next_time : (datetime)
             A datetime that indicates the next calendar time a handler
             should be called.
     """
 
-    def __init__(self, period, handler):
+    def __init__(self, period, handler, priority=PRIORITY_NORMAL):
         self._period = period
         self._handler = handler
+        self._priority = priority
         self._futures = []
         current_time = datetime.datetime.now()
         period_seconds = timedelta(seconds=self._period)
@@ -241,8 +597,8 @@ class Timer:
         """Passes handler to worker thread and updates _next_time"""
         self.wait_time()
         self._futures = [x for x in self._futures if not x.done()]
-        self._futures.append(mavconn_instance._threadpool.submit(
-            self._handler, mavconn_instance))
+        self._futures.append(mavconn_instance._dispatcher.submit(
+            self._priority, self._handler, mavconn_instance))
         current_time = datetime.datetime.now()
         period_seconds = timedelta(seconds=self._period)
         self._next_time = current_time + period_seconds
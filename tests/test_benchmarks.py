@@ -0,0 +1,67 @@
+import pytest
+
+from benchmarks.fakemav import FakeMavfile, encode_frame, mavlink
+from benchmarks import bench_dispatch, bench_raw
+
+def test_fake_mavfile():
+    mavfile = FakeMavfile(mix={'HEARTBEAT': 1, 'ATTITUDE': 3}, count=100, seed=1)
+    messages = [mavfile.recv_match(blocking=True) for _ in range(100)]
+    assert {m.get_type() for m in messages} == {'HEARTBEAT', 'ATTITUDE'}
+    assert all(a.created <= b.created for a, b in zip(messages, messages[1:]))
+    assert mavfile.recv_match() is None
+    again = FakeMavfile(mix={'HEARTBEAT': 1, 'ATTITUDE': 3}, count=100, seed=1)
+    assert ([again.recv_match().get_type() for _ in range(100)]
+            == [m.get_type() for m in messages])
+    mavfile.mav.heartbeat_send(mavlink.MAV_TYPE_GCS,
+                               mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+    assert mavfile.sent == 1
+
+def test_percentiles():
+    stats = bench_dispatch.percentiles([float(x) for x in range(1, 101)])
+    assert stats['count'] == 100
+    assert stats['p50'] == 51.0
+    assert stats['max'] == 100.0
+    assert bench_dispatch.percentiles([]) == {'count': 0}
+
+def test_bench_smoke(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    results = bench_dispatch.main(['--messages', '200', '--rate', '500',
+                                   '--duration', '0.2', '--period', '0.02',
+                                   '--calls', '50', '--output', output])
+    assert results['results']['throughput']['msgs_per_second'] > 0
+    assert results['results']['latency']['latency']['count'] == 100
+    assert results['results']['send']['calls'] == 200
+    lines = bench_dispatch.compare(results, results)
+    assert lines[0] == '{0} -> {0}'.format(results['version'])
+    assert any('throughput.msgs_per_second' in line for line in lines)
+
+def test_fake_mavfile_recv():
+    mavfile = FakeMavfile(mix={'HEARTBEAT': 1}, count=20)
+    stream = b''.join(encode_frame('HEARTBEAT') for _ in range(20))
+    chunks = [mavfile.recv(100) for _ in range(5)]
+    assert [len(chunk) for chunk in chunks] == [100, 100, 100, 100, 20]
+    assert b''.join(chunks) == stream
+    assert mavfile.recv(100) == b''
+    message = mavfile.mav.decode(bytearray(encode_frame('COMMAND_ACK', seq=3)))
+    assert (message.get_type(), message.get_seq()) == ('COMMAND_ACK', 3)
+
+def test_bench_raw_smoke():
+    results = bench_raw.main(['--rate', '2000', '--duration', '0.2'])
+    assert sorted(results['results']) == sorted(bench_raw.MODES)
+    assert all(r['packets'] == 360 for r in results['results'].values())
+    assert all(r['sampled_packets'] > 0 for r in results['results'].values())
+    decoded = results['results']['decoded']
+    raw = results['results']['raw']
+    assert decoded['blocks_per_packet'] > raw['blocks_per_packet'] > 0
+
+class DroppingMavfile(FakeMavfile):
+    def recv_match(self, *args, **kwargs):
+        message = FakeMavfile.recv_match(self, *args, **kwargs)
+        if self._seq == 51:
+            return None
+        return message
+
+def test_bench_timeout(monkeypatch):
+    monkeypatch.setattr(bench_dispatch, 'FakeMavfile', DroppingMavfile)
+    with pytest.raises(TimeoutError, match='handled 99 of 100 messages'):
+        bench_dispatch.bench_throughput(100, 1, timeout=1)
@@ -0,0 +1,111 @@
+import pytest
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from mavconn.mavconn import Dispatcher
+from mavconn.mavconn import MAVLinkConnection
+from mavconn.mavconn import PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BULK
+from benchmarks.fakemav import FakeMavfile
+
+mavfile = 1.0
+
+def test_dispatcher_priority_order():
+    threadpool = ThreadPoolExecutor(max_workers=1)
+    dispatcher = Dispatcher(threadpool)
+    order = []
+    release = threading.Event()
+    futures = [threadpool.submit(release.wait)]
+    futures.append(dispatcher.submit(PRIORITY_BULK, order.append, 'bulk1'))
+    futures.append(dispatcher.submit(PRIORITY_NORMAL, order.append, 'normal'))
+    futures.append(dispatcher.submit(PRIORITY_BULK, order.append, 'bulk2'))
+    futures.append(dispatcher.submit(PRIORITY_CRITICAL, order.append, 'critical'))
+    release.set()
+    wait(futures)
+    threadpool.shutdown()
+    assert order == ['critical', 'normal', 'bulk1', 'bulk2']
+    stats = dispatcher.stats()
+    assert sorted(stats) == [PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BULK]
+    assert stats[PRIORITY_BULK]['count'] == 2
+    assert stats[PRIORITY_CRITICAL]['count'] == 1
+    assert stats[PRIORITY_BULK]['max'] >= stats[PRIORITY_BULK]['mean'] >= 0
+
+def test_handler_priorities():
+    test_mav = MAVLinkConnection(mavfile)
+    test_mav.push_handler('HEARTBEAT', 'handler1', PRIORITY_CRITICAL)
+    test_mav.push_handler('HEARTBEAT', 'handler2')
+    assert test_mav._priorities == {'HEARTBEAT': [PRIORITY_CRITICAL, PRIORITY_NORMAL]}
+    assert test_mav.pop_handler('HEARTBEAT') == 'handler2'
+    assert test_mav._priorities == {'HEARTBEAT': [PRIORITY_CRITICAL]}
+    test_mav.clear_handler()
+    assert test_mav._priorities == {}
+    assert test_mav.queue_wait_stats() == {}
+
+def test_supplied_executor():
+    threadpool = ThreadPoolExecutor(max_workers=2)
+    test_mav = MAVLinkConnection(mavfile, executor=threadpool)
+    assert test_mav._threadpool is threadpool
+    assert not test_mav._owns_threadpool
+    sized_mav = MAVLinkConnection(mavfile, max_workers=4)
+    assert sized_mav._threadpool is None
+    assert sized_mav._owns_threadpool
+    threadpool.shutdown()
+
+def test_dispatcher_futures():
+    threadpool = ThreadPoolExecutor(max_workers=1)
+    dispatcher = Dispatcher(threadpool)
+    release = threading.Event()
+    blocker = threadpool.submit(release.wait)
+    def fail():
+        raise ValueError('bulk failed')
+    bulk = dispatcher.submit(PRIORITY_BULK, fail)
+    critical = dispatcher.submit(PRIORITY_CRITICAL, lambda: 'critical')
+    release.set()
+    assert critical.result(timeout=5) == 'critical'
+    with pytest.raises(ValueError, match='bulk failed'):
+        bulk.result(timeout=5)
+    threadpool.shutdown()
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(PRIORITY_CRITICAL, lambda: None)
+    assert dispatcher._jobs == []
+
+def test_executor_and_max_workers():
+    threadpool = ThreadPoolExecutor(max_workers=2)
+    with pytest.raises(ValueError):
+        MAVLinkConnection(mavfile, max_workers=2, executor=threadpool)
+    threadpool.shutdown()
+
+def test_connection_priorities():
+    threadpool = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    blocker = threadpool.submit(release.wait)
+    mix = {'HEARTBEAT': 1, 'ATTITUDE': 1}
+    test_mav = MAVLinkConnection(FakeMavfile(mix=mix, count=40), executor=threadpool)
+    order = []
+    test_mav.push_handler('ATTITUDE', lambda m, message: order.append('bulk'),
+                          PRIORITY_BULK)
+    test_mav.push_handler('HEARTBEAT', lambda m, message: order.append('critical'),
+                          PRIORITY_CRITICAL)
+    test_mav.add_timer(0.05, lambda m: order.append('timer'), PRIORITY_NORMAL)
+    with test_mav:
+        deadline = time.monotonic() + 5
+        while (test_mav._mavfile._remaining() or
+               not any(job[0] == PRIORITY_NORMAL for job in test_mav._dispatcher._jobs)):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        queued = len(test_mav._dispatcher._jobs)
+        release.set()
+        while len(order) < queued:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    threadpool.shutdown()
+    first_bulk = order.index('bulk')
+    assert 'critical' not in order[first_bulk:]
+    assert 'timer' in order[:first_bulk]
+    assert order.index('timer') > max(i for i, name in enumerate(order[:first_bulk])
+                                       if name == 'critical')
+    stats = test_mav.queue_wait_stats()
+    assert stats[PRIORITY_CRITICAL]['count'] == order.count('critical')
+    assert stats[PRIORITY_BULK]['count'] == order.count('bulk')
+    assert stats[PRIORITY_NORMAL]['count'] == order.count('timer')
+    assert stats[PRIORITY_BULK]['max'] > stats[PRIORITY_CRITICAL]['mean'] > 0
@@ -0,0 +1,194 @@
+import io
+import pytest
+import threading
+
+from mavconn.frame import FrameParser, MAX_FRAME_LENGTH
+from concurrent.futures import ThreadPoolExecutor
+
+from mavconn.mavconn import MAVLinkConnection, Dispatcher
+from benchmarks.fakemav import FakeMavfile, encode_frame, mavlink
+
+crc_extras = {msgid: message.crc_extra
+              for msgid, message in mavlink.mavlink_map.items()}
+
+v1_frame = bytes([0xFE, 2, 7, 1, 190, 77, 0xAA, 0xBB, 0x01, 0x02])
+v2_frame = encode_frame('ATTITUDE', seq=9, sysid=3, compid=4)
+unknown_frame = bytes([0xFD, 3, 0, 0, 1, 1, 1, 0x60, 0xEA, 0x00, 7, 8, 9,
+                       0x12, 0x34])
+signed_frame = (bytes([0xFD, 1, 0x01, 0, 5, 1, 1, 0x10, 0x27, 0x00, 0x42])
+                + bytes(2 + 13))
+
+def parse(parser, data):
+    return [(header.version, header.msgid, header.seq, header.sysid,
+             header.compid, header.signed, bytes(frame))
+            for header, frame in parser.feed(data)]
+
+def test_frame_parser():
+    parser = FrameParser()
+    frames = parse(parser, b'\x00\x01' + v1_frame + v2_frame + b'\x55'
+                   + signed_frame)
+    assert frames == [(1, 77, 7, 1, 190, False, v1_frame),
+                      (2, 30, 9, 3, 4, False, v2_frame),
+                      (2, 10000, 5, 1, 1, True, signed_frame)]
+
+def test_frame_parser_split():
+    parser = FrameParser(size=MAX_FRAME_LENGTH)
+    data = (v2_frame + v1_frame) * 30
+    frames = []
+    for offset in range(0, len(data), 7):
+        frames.extend(parse(parser, data[offset:offset + 7]))
+    assert [f[-1] for f in frames] == [v2_frame, v1_frame] * 30
+    frames = parse(parser, data)
+    assert [f[-1] for f in frames] == [v2_frame, v1_frame] * 30
+
+def test_frame_parser_size():
+    with pytest.raises(ValueError):
+        FrameParser(size=MAX_FRAME_LENGTH - 1)
+
+def test_frame_parser_crc():
+    heartbeat = encode_frame('HEARTBEAT')
+    parser = FrameParser(crc_extras)
+    frames = parse(parser, b'\xfe\xff' + heartbeat * 20)
+    assert [f[-1] for f in frames] == [heartbeat] * 20
+    corrupt = bytearray(heartbeat)
+    corrupt[12] ^= 0x01
+    frames = parse(parser, bytes(corrupt) + v1_frame + heartbeat)
+    assert [f[-1] for f in frames] == [heartbeat]
+    assert [header.crc_ok for header, frame in parser.feed(heartbeat)] == [True]
+    parser.crc_extras = None
+    assert [header.crc_ok for header, frame in parser.feed(corrupt)] == [None]
+
+def test_frame_parser_unknown_msgid():
+    parser = FrameParser(crc_extras)
+    frames = [(header.msgid, header.crc_ok, bytes(frame))
+              for header, frame in parser.feed(unknown_frame + v2_frame)]
+    assert frames == [(60000, None, unknown_frame), (30, True, v2_frame)]
+
+def test_frame_parser_drain():
+    parser = FrameParser()
+    assert parse(parser, v2_frame[:5]) == []
+    assert parser.drain() == v2_frame[:5]
+    assert parse(parser, v2_frame)[0][-1] == v2_frame
+
+def test_frame_reused_buffer():
+    parser = FrameParser()
+    views = [frame for header, frame in parser.feed(v2_frame)]
+    list(parser.feed(v1_frame))
+    assert bytes(views[0][:len(v1_frame)]) == v1_frame
+
+def test_raw_handlers():
+    test_mav = MAVLinkConnection(FakeMavfile())
+    test_mav.push_raw_handler(0, 'handler1')
+    test_mav.push_raw_handler('*', 'handler2')
+    assert test_mav._raw_stacks == {0: ['handler1'], '*': ['handler2']}
+    assert test_mav.pop_raw_handler(0) == 'handler1'
+    with pytest.raises(KeyError):
+        test_mav.pop_raw_handler(0)
+    test_mav.clear_raw_handler('*')
+    test_mav.clear_raw_handler()
+    assert test_mav._raw_stacks == {}
+
+def test_raw_handler_exception():
+    mavfile = FakeMavfile(mix={'HEARTBEAT': 1}, count=50)
+    mavfile.logfile = io.BytesIO()
+    test_mav = MAVLinkConnection(mavfile)
+    done = threading.Event()
+    frames = []
+    def raw_handler(mavconn_instance, header, frame):
+        frames.append(header.seq)
+        if len(frames) == 50:
+            done.set()
+        raise ValueError('raw handler failed')
+    test_mav.push_raw_handler('*', raw_handler)
+    test_mav.add_timer(0.1, lambda mavconn_instance: None)
+    with test_mav:
+        assert done.wait(5)
+        assert test_mav._listening_thread.is_alive()
+    assert len(frames) == 50
+    assert len(mavfile.logfile.getvalue()) == 50 * (8 + len(encode_frame('HEARTBEAT')))
+
+def test_raw_dispatch():
+    mavfile = FakeMavfile(mix={'HEARTBEAT': 1, 'ATTITUDE': 1}, count=200)
+    test_mav = MAVLinkConnection(mavfile)
+    done = threading.Event()
+    raw = []
+    decoded = []
+    def raw_handler(mavconn_instance, header, frame):
+        raw.append((header.msgid, bytes(frame)))
+    def any_handler(mavconn_instance, header, frame):
+        raw.append((header.msgid, None))
+    def decoded_handler(mavconn_instance, mav_message):
+        decoded.append(mav_message.get_type())
+        if len(decoded) == 200:
+            done.set()
+    test_mav.push_raw_handler(0, raw_handler)
+    test_mav.push_raw_handler('*', any_handler)
+    test_mav.push_handler('*', decoded_handler)
+    test_mav.add_timer(0.1, lambda mavconn_instance: None)
+    with test_mav:
+        assert done.wait(5)
+    assert len(raw) == 200
+    assert all(frame == encode_frame('HEARTBEAT') for msgid, frame in raw
+               if msgid == 0)
+    assert all(frame is None for msgid, frame in raw if msgid == 30)
+    assert sorted(set(decoded)) == ['ATTITUDE', 'HEARTBEAT']
+
+def test_raw_unknown_msgid():
+    mavfile = FakeMavfile(mix={'HEARTBEAT': 1}, count=1)
+    mavfile._pending += unknown_frame
+    test_mav = MAVLinkConnection(mavfile)
+    done = threading.Event()
+    raw = []
+    def any_handler(mavconn_instance, header, frame):
+        raw.append((header.msgid, header.crc_ok, bytes(frame)))
+        if len(raw) == 2:
+            done.set()
+    test_mav.push_raw_handler('*', any_handler)
+    test_mav.push_handler('*', lambda mavconn_instance, mav_message: None)
+    test_mav.add_timer(0.1, lambda mavconn_instance: None)
+    with test_mav:
+        assert done.wait(5)
+    assert raw == [(60000, None, unknown_frame),
+                   (0, True, encode_frame('HEARTBEAT'))]
+
+def test_switch_mode():
+    mavfile = FakeMavfile(count=0)
+    test_mav = MAVLinkConnection(mavfile)
+    raw = []
+    test_mav.push_raw_handler('*', lambda m, header, frame: raw.append(bytes(frame)))
+    heartbeat = encode_frame('HEARTBEAT')
+    assert mavfile.mav.parse_char(heartbeat[:7]) is None
+    test_mav._switch_mode(True)
+    assert mavfile.mav.buf == bytearray()
+    test_mav._handle_frames(heartbeat[7:] + v2_frame[:4])
+    assert raw == [heartbeat]
+    test_mav._switch_mode(False)
+    message = mavfile.mav.parse_char(v2_frame[4:])
+    assert message.get_type() == 'ATTITUDE'
+
+def test_decode_leaves_stream_buffer():
+    mavfile = FakeMavfile(count=0)
+    test_mav = MAVLinkConnection(mavfile, executor=ThreadPoolExecutor(max_workers=1))
+    test_mav._dispatcher = Dispatcher(test_mav._threadpool)
+    decoded = []
+    test_mav.push_raw_handler('*', lambda m, header, frame: None)
+    test_mav.push_handler('*', lambda m, mav_message: decoded.append(mav_message))
+    mavfile.mav.buf.extend(b'\x01\x02')
+    test_mav._handle_frames(encode_frame('HEARTBEAT') * 3)
+    test_mav._threadpool.shutdown()
+    assert [m.get_type() for m in decoded] == ['HEARTBEAT'] * 3
+    assert mavfile.mav.buf == bytearray(b'\x01\x02')
+
+class SubMAVLink(mavlink.MAVLink):
+    pass
+
+def test_crc_extras_fallback(caplog):
+    mavfile = FakeMavfile(count=0)
+    mavfile.mav = SubMAVLink(mavfile)
+    test_mav = MAVLinkConnection(mavfile)
+    test_mav._update_crc_extras()
+    assert test_mav._parser.crc_extras is None
+    assert 'No CRC_EXTRA table' in caplog.text
+    mavfile.mav = mavlink.MAVLink(mavfile)
+    test_mav._update_crc_extras()
+    assert test_mav._parser.crc_extras[0] == 50
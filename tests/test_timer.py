@@ -5,6 +5,7 @@ from heapq import heappush, heappop
 
 from mavconn.mavconn import Timer
 from mavconn.mavconn import MAVLinkConnection
+from mavconn.mavconn import PRIORITY_CRITICAL, PRIORITY_NORMAL
 
 period = 1
 period2 = 2
@@ -30,6 +31,10 @@ def test_timer_init():
     assert test_timer == test_timer3
     assert not (test_timer == period)
 
+def test_timer_priority():
+    assert Timer(period, handler)._priority == PRIORITY_NORMAL
+    assert Timer(period, handler, PRIORITY_CRITICAL)._priority == PRIORITY_CRITICAL
+
 #def test_add_timer():
 #    add_test = MAVLinkConnection(mavfile)
 #    add_test.start()